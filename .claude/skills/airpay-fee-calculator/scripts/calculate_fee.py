@@ -7,12 +7,13 @@ Airペイ手数料計算スクリプト
 """
 
 import csv
-import math
+import functools
 import sys
 import os
 import re
 import calendar
 from collections import defaultdict
+from itertools import groupby
 from datetime import datetime
 
 # 手数料率の定義
@@ -21,43 +22,37 @@ RATE_324 = 0.0324        # iD, QUICPay 非課税
 RATE_3245 = 0.03245      # 交通系電子マネー、QR決済（2.95%+税）課税
 
 
-def get_rate_info(brand):
-    """決済ブランドから手数料率情報を取得"""
-    brand = brand.strip()
-
+# 決済ブランド判定表（上から順に判定し、最初に一致したものを採用）
+_RATE_TABLE = [
     # キャンペーン対象（クレジットカード）: 2.48%
-    campaign_brands = ['Visa', 'Mastercard(R)', 'JCB', 'American Express', 'Diners Club', 'Discover']
-    for cb in campaign_brands:
-        if cb in brand:
-            return (RATE_CAMPAIGN, '2.48%', '非課税')
-
+    (re.compile(r'Visa|Mastercard\(R\)|JCB|American Express|Diners Club|Discover'),
+     (RATE_CAMPAIGN, '2.48%', '非課税')),
     # iD, QUICPay: 3.24%
-    if 'iD' in brand or 'QUICPay' in brand:
-        return (RATE_324, '3.24%', '非課税')
-
+    (re.compile(r'iD|QUICPay'), (RATE_324, '3.24%', '非課税')),
     # 交通系電子マネー: 3.245%
-    if '交通系' in brand or '電子マネー' in brand:
-        return (RATE_3245, '3.245%', '課税')
-
+    (re.compile(r'交通系|電子マネー'), (RATE_3245, '3.245%', '課税')),
     # QR決済: 3.245%
-    qr_brands = ['PayPay', 'd払い', '楽天ペイ', 'au PAY', 'COIN+', 'WeChat', 'Alipay']
-    for qb in qr_brands:
-        if qb in brand:
-            return (RATE_3245, '3.245%', '課税')
+    (re.compile(r'PayPay|d払い|楽天ペイ|au PAY|COIN\+|WeChat|Alipay'), (RATE_3245, '3.245%', '課税')),
+]
 
-    # デフォルト（不明なブランド）
-    return (RATE_3245, '3.245%', '課税')
 
+@functools.lru_cache(maxsize=64)
+def get_rate_info(brand):
+    """決済ブランドから手数料率情報を取得"""
+    brand = brand.strip()
 
-def detect_valid_rows(rows):
-    """有効なデータ行数を検出（重複データ対策）"""
-    date_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+    for pattern, rate_info in _RATE_TABLE:
+        if pattern.search(brand):
+            return rate_info
+
+    # デフォルト（不明なブランド）
+    return (RATE_3245, '3.245%', '課税')
 
-    for i, row in enumerate(rows[1:], 1):
-        if not row or not row[0] or not date_pattern.match(row[0]):
-            return i
 
-    return len(rows)
+@functools.lru_cache(maxsize=256)
+def last_day_of_month(year, month):
+    """指定年月の月末日を取得"""
+    return calendar.monthrange(year, month)[1]
 
 
 def is_last_day_of_month(date_str):
@@ -66,43 +61,55 @@ def is_last_day_of_month(date_str):
         year = int(date_str[:4])
         month = int(date_str[5:7])
         day = int(date_str[8:10])
-        last_day = calendar.monthrange(year, month)[1]
-        return day == last_day
+        return day == last_day_of_month(year, month)
     except (ValueError, IndexError):
         return False
 
 
+@functools.lru_cache(maxsize=1024)
 def get_accounting_label(payment_date, usage_date):
-    """入金日と利用日から会計ラベルを生成（月末日分離対応）"""
+    """入金日と利用日から会計ラベルと会計月を生成（月末日分離対応）
+
+    Returns:
+        (label, accounting_month)
+    """
     usage_month = usage_date[:7]  # YYYY-MM
 
     if is_last_day_of_month(usage_date):
-        # 月末日は別グループ
-        return f'{payment_date} (利用日:{usage_date}=月末)'
+        # 月末日は別グループ（会計月は利用日の月）
+        return f'{payment_date} (利用日:{usage_date}=月末)', usage_month
     else:
-        return f'{payment_date} (利用月:{usage_month})'
+        return f'{payment_date} (利用月:{usage_month})', usage_month
 
 
 def calculate_fees(input_file, output_file=None, max_rows=None):
     """手数料を計算してCSVに出力"""
 
-    # ファイル読み込み
+    date_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+    # (会計ラベル, 決済ブランド) ごとに金額を集計
+    data = defaultdict(int)
+    # 会計ラベル → 会計月
+    label_months = {}
+
+    # ファイルを1行ずつ読み込みながら集計（全行をメモリに保持しない）
     with open(input_file, 'r', encoding='cp932') as f:
         reader = csv.reader(f)
-        rows = list(reader)
+        next(reader, None)  # ヘッダー
 
-    # 有効行数を自動検出または指定値を使用
-    if max_rows:
-        rows = rows[:max_rows + 1]
-    else:
-        valid_count = detect_valid_rows(rows)
-        rows = rows[:valid_count]
+        row_count = 0
+        for row in reader:
+            # 有効行数を指定値で制限、または最初の非データ行で打ち切り（重複データ対策）
+            if max_rows:
+                if row_count >= max_rows:
+                    break
+            elif not row or not row[0] or not date_pattern.match(row[0]):
+                break
+            row_count += 1
 
-    # 入金日・会計ラベル・決済ブランドごとに金額を集計
-    data = defaultdict(lambda: defaultdict(int))
+            if len(row) < 9:
+                continue
 
-    for row in rows[1:]:
-        if len(row) >= 9:
             payment_date = row[0]   # 入金日
             usage_date = row[4]     # 利用日
             brand = row[5]          # 決済ブランド
@@ -111,8 +118,9 @@ def calculate_fees(input_file, output_file=None, max_rows=None):
             if payment_date and brand and usage_date:
                 try:
                     amount = int(amount_str)
-                    label = get_accounting_label(payment_date, usage_date)
-                    data[label][brand] += amount
+                    label, accounting_month = get_accounting_label(payment_date, usage_date)
+                    data[(label, brand)] += amount
+                    label_months[label] = accounting_month
                 except (ValueError, TypeError):
                     pass
 
@@ -138,16 +146,15 @@ def calculate_fees(input_file, output_file=None, max_rows=None):
     # 会計月別の集計用
     monthly_totals = defaultdict(lambda: {'amount': 0, 'fee': 0})
 
-    for label in sorted(data.keys()):
+    # (会計ラベル, 決済ブランド) 順に1回だけソートし、会計ラベルでグループ化
+    for label, group in groupby(sorted(data.items()), key=lambda item: item[0][0]):
         label_total_amount = 0
         label_total_fee = 0
 
-        for brand in sorted(data[label].keys()):
-            amount = data[label][brand]
+        for (_, brand), amount in group:
             rate, rate_str, tax_type = get_rate_info(brand)
-            fee = math.floor(abs(amount) * rate)
-            if amount < 0:
-                fee = -fee
+            # 符号を保ったまま1円未満切り捨て（0方向への切り捨て = int()）
+            fee = int(amount * rate)
 
             output_rows.append([label, brand, amount, tax_type, rate_str, fee])
 
@@ -160,20 +167,8 @@ def calculate_fees(input_file, output_file=None, max_rows=None):
         grand_total_amount += label_total_amount
         grand_total_fee += label_total_fee
 
-        # 会計月を抽出して月別集計
-        if '利用日:' in label and '=月末' in label:
-            # 月末日の場合: 利用日の月を使用
-            month_match = re.search(r'利用日:(\d{4}-\d{2})', label)
-            if month_match:
-                accounting_month = month_match.group(1)
-        else:
-            # 通常: 利用月を使用
-            month_match = re.search(r'利用月:(\d{4}-\d{2})', label)
-            if month_match:
-                accounting_month = month_match.group(1)
-            else:
-                accounting_month = 'unknown'
-
+        # 会計月別集計
+        accounting_month = label_months[label]
         monthly_totals[accounting_month]['amount'] += label_total_amount
         monthly_totals[accounting_month]['fee'] += label_total_fee
 
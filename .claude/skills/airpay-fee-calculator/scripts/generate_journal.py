@@ -6,12 +6,38 @@ Airペイ → 弥生仕訳CSV生成スクリプト
 """
 
 import csv
+import functools
 import math
 import sys
 import os
 import re
 import calendar
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+
+# 日付形式（YYYY-MM-DD）
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# 入金サイクルごとのサマリー（売上合計・課税手数料・消費税額・非課税手数料・振込金額）
+Summary = namedtuple('Summary', ['sales', 'fee_taxable', 'tax', 'fee_non_taxable', 'transfer'],
+                     defaults=(0, 0, 0, 0, 0))
+
+
+@functools.lru_cache(maxsize=256)
+def last_day_of_month(year, month):
+    """指定年月の月末日を取得"""
+    return calendar.monthrange(year, month)[1]
+
+
+@functools.lru_cache(maxsize=1024)
+def get_month_key(usage_date):
+    """利用日から会計月キーを生成（月末日は別キー）"""
+    year = int(usage_date[:4])
+    month = int(usage_date[5:7])
+    day = int(usage_date[8:10])
+
+    if day == last_day_of_month(year, month):
+        return f'{usage_date[:7]}(月末)'
+    return usage_date[:7]
 
 
 def parse_summaries_from_csv(rows):
@@ -28,26 +54,29 @@ def parse_summaries_from_csv(rows):
             if '売上合計' in label or '合計金額' in label:
                 # このサマリーブロックの入金日を特定（直前のデータ行から）
                 for j in range(i - 1, -1, -1):
-                    if len(rows[j]) >= 1 and re.match(r'^\d{4}-\d{2}-\d{2}$', rows[j][0]):
+                    if len(rows[j]) >= 1 and DATE_PATTERN.match(rows[j][0]):
                         current_payment_date = rows[j][0]
                         break
 
                 if current_payment_date:
-                    summary = {'sales': int(row[8])}
+                    fields = {'sales': int(row[8])}
                     # 続くサマリー行を読む
                     for k in range(i + 1, min(i + 8, len(rows))):
                         if len(rows[k]) >= 9 and rows[k][7]:
                             l = rows[k][7]
-                            v = int(rows[k][8]) if rows[k][8].lstrip('-').isdigit() else 0
+                            try:
+                                v = int(rows[k][8])
+                            except ValueError:
+                                v = 0
                             if '課税10%' in l or '10%対象' in l:
-                                summary['fee_taxable'] = v
+                                fields['fee_taxable'] = v
                             elif '消費税額' in l:
-                                summary['tax'] = v
+                                fields['tax'] = v
                             elif '非課税' in l and '手数料' in l:
-                                summary['fee_non_taxable'] = v
+                                fields['fee_non_taxable'] = v
                             elif '振込金額' in l and '差引' not in l and '確定' not in l:
-                                summary['transfer'] = v
-                    summaries[current_payment_date] = summary
+                                fields['transfer'] = v
+                    summaries[current_payment_date] = Summary(**fields)
         i += 1
 
     return summaries
@@ -55,24 +84,21 @@ def parse_summaries_from_csv(rows):
 
 def find_detail_ranges(rows, summaries):
     """各入金サイクルの明細範囲を特定"""
-    detail_ranges = {}
-    payment_dates = sorted(summaries.keys(), reverse=True)
-
-    # 各入金日のデータ開始位置を探す
-    for payment_date in payment_dates:
-        start = None
-        end = None
-
-        # ヘッダー行（入金日,利用日...）の後からデータが始まる
-        for i, row in enumerate(rows):
-            if len(row) >= 9 and row[0] == payment_date:
-                if start is None:
-                    start = i
-                end = i + 1
+    ranges = {}
+
+    # 1回の走査で入金日ごとの最初と最後のデータ行位置を記録
+    for i, row in enumerate(rows):
+        if len(row) >= 9 and row[0] in summaries:
+            payment_date = row[0]
+            if payment_date not in ranges:
+                ranges[payment_date] = [i, i + 1]
+            else:
+                ranges[payment_date][1] = i + 1
 
-        # 最後のデータ行の次がサマリー行
-        if start is not None:
-            detail_ranges[payment_date] = (start, end)
+    detail_ranges = {}
+    for payment_date in sorted(ranges.keys(), reverse=True):
+        start, end = ranges[payment_date]
+        detail_ranges[payment_date] = (start, end)
 
     return detail_ranges
 
@@ -85,8 +111,8 @@ def calculate_split_data(rows, summaries, detail_ranges):
         start, end = detail_ranges[payment_date]
         summary = summaries[payment_date]
 
-        # 会計月別に集計
-        by_month = defaultdict(lambda: {'taxable': 0, 'non_taxable': 0})
+        # (会計月, 課税区分) ごとに集計
+        by_month = defaultdict(int)
 
         for i in range(start, end):
             row = rows[i]
@@ -97,40 +123,33 @@ def calculate_split_data(rows, summaries, detail_ranges):
 
                 try:
                     amount = int(amount_str)
-                    year = int(usage_date[:4])
-                    month = int(usage_date[5:7])
-                    day = int(usage_date[8:10])
-                    last_day = calendar.monthrange(year, month)[1]
-
-                    if day == last_day:
-                        month_key = f'{usage_date[:7]}(月末)'
-                    else:
-                        month_key = usage_date[:7]
+                    month_key = get_month_key(usage_date)
 
                     if '非' in tax_type:
-                        by_month[month_key]['non_taxable'] += amount
+                        by_month[(month_key, 'non_taxable')] += amount
                     else:
-                        by_month[month_key]['taxable'] += amount
+                        by_month[(month_key, 'taxable')] += amount
                 except:
                     pass
 
         # 按分計算
-        total_taxable = sum(d['taxable'] for d in by_month.values())
-        total_non_taxable = sum(d['non_taxable'] for d in by_month.values())
+        total_taxable = sum(v for (_, kind), v in by_month.items() if kind == 'taxable')
+        total_non_taxable = sum(v for (_, kind), v in by_month.items() if kind == 'non_taxable')
 
         allocated = {'fee_taxable': 0, 'fee_non_taxable': 0}
-        month_keys = sorted(by_month.keys())
+        month_keys = sorted({month_key for month_key, _ in by_month})
 
         for idx, month_key in enumerate(month_keys):
-            data = by_month[month_key]
+            taxable = by_month.get((month_key, 'taxable'), 0)
+            non_taxable = by_month.get((month_key, 'non_taxable'), 0)
             is_last = (idx == len(month_keys) - 1)
 
             # 課税手数料の按分
             if total_taxable > 0:
                 if is_last:
-                    fee_taxable = summary.get('fee_taxable', 0) - allocated['fee_taxable']
+                    fee_taxable = summary.fee_taxable - allocated['fee_taxable']
                 else:
-                    fee_taxable = math.floor(summary.get('fee_taxable', 0) * data['taxable'] / total_taxable)
+                    fee_taxable = math.floor(summary.fee_taxable * taxable / total_taxable)
             else:
                 fee_taxable = 0
             allocated['fee_taxable'] += fee_taxable
@@ -138,14 +157,14 @@ def calculate_split_data(rows, summaries, detail_ranges):
             # 非課税手数料の按分
             if total_non_taxable > 0:
                 if is_last:
-                    fee_non_taxable = summary.get('fee_non_taxable', 0) - allocated['fee_non_taxable']
+                    fee_non_taxable = summary.fee_non_taxable - allocated['fee_non_taxable']
                 else:
-                    fee_non_taxable = math.floor(summary.get('fee_non_taxable', 0) * data['non_taxable'] / total_non_taxable)
+                    fee_non_taxable = math.floor(summary.fee_non_taxable * non_taxable / total_non_taxable)
             else:
                 fee_non_taxable = 0
             allocated['fee_non_taxable'] += fee_non_taxable
 
-            sales = data['taxable'] + data['non_taxable']
+            sales = taxable + non_taxable
             transfer = sales - fee_taxable - fee_non_taxable
 
             results.append({
@@ -160,6 +179,7 @@ def calculate_split_data(rows, summaries, detail_ranges):
     return results
 
 
+@functools.lru_cache(maxsize=128)
 def to_reiwa_date(date_str):
     """2025-11-06 -> R.07/11/06"""
     year = int(date_str[:4])
@@ -169,10 +189,8 @@ def to_reiwa_date(date_str):
     return f'R.{reiwa_year:02d}/{month}/{day}'
 
 
-def generate_journal_csv(results, department, subsidiary_suffix):
-    """弥生仕訳CSVを生成"""
-    journal_rows = []
-
+def iter_journal_rows(results, department, subsidiary_suffix):
+    """弥生仕訳CSVの行を順に生成"""
     for r in results:
         date = to_reiwa_date(r['payment_date'])
         sales = r['sales']
@@ -184,36 +202,34 @@ def generate_journal_csv(results, department, subsidiary_suffix):
         note_suffix = f'({month_label})' if '月末' in month_label else ''
 
         # 行1: 売上高（貸方）
-        journal_rows.append([
+        yield [
             '2110', '', '', date, '', '', '', '対象外', '0', '',
             '売上高(10%)', '', department, '課税売上込10%', str(sales), '',
             f'リクルートペイメント　売上{note_suffix}', '', '', '3', '', '', '0', '0', 'no'
-        ])
+        ]
 
         # 行2: 課税手数料（借方）
         if fee_taxable > 0:
-            journal_rows.append([
+            yield [
                 '2100', '', '', date, 'クレジット手数料', 'クレジット手数料(課税)', department,
                 '課対仕入込10%適格', str(fee_taxable), '', '', '', '', '対象外', '0', '',
                 f'リクルートペイメント　手数料/課税{note_suffix}', '', '', '3', '', '', '0', '0', 'no'
-            ])
+            ]
 
         # 行3: 非課税手数料（借方）
         if fee_non_taxable > 0:
-            journal_rows.append([
+            yield [
                 '2100', '', '', date, 'クレジット手数料', 'クレジット手数料', department,
                 '非課仕入', str(fee_non_taxable), '', '', '', '', '対象外', '0', '',
                 f'リクルートペイメント　手数料/非課税{note_suffix}', '', '', '3', '', '', '0', '0', 'no'
-            ])
+            ]
 
         # 行4: 売掛金（借方）
-        journal_rows.append([
+        yield [
             '2101', '', '', date, '売掛金', f'㈱ﾘｸﾙｰﾄﾍﾟｲﾒﾝﾄ/{subsidiary_suffix}', '',
             '対象外', str(transfer), '', '', '', '', '対象外', '0', '',
             f'リクルートペイメント　入金額{note_suffix}', '', '', '3', '', '', '0', '0', 'no'
-        ])
-
-    return journal_rows
+        ]
 
 
 def deduplicate_rows(rows):
@@ -223,8 +239,8 @@ def deduplicate_rows(rows):
     duplicate_count = 0
 
     for row in rows:
-        # データ行（入金日が2025-で始まる）の場合のみ重複チェック
-        if len(row) >= 9 and row[0] and row[0].startswith('202'):
+        # データ行（入金日が日付形式）の場合のみ重複チェック
+        if len(row) >= 9 and DATE_PATTERN.match(row[0]):
             # ユニークキー: 入金日,利用日,決済ブランド,カード番号,金額,税区分
             key = (row[0], row[4], row[5], row[6], row[8], row[9] if len(row) > 9 else '')
             if key in seen:
@@ -253,10 +269,11 @@ def main():
     subsidiary_suffix = sys.argv[3] if len(sys.argv) > 3 else department
     output_file = sys.argv[4] if len(sys.argv) > 4 else None
 
-    # ファイル読み込み
+    # ファイル読み込み（サマリー抽出と明細集計で複数回走査するため保持する）
+    # 列位置は維持したまま、未使用の末尾列（備考）を落としたタプルで持つ
     with open(input_file, 'r', encoding='cp932') as f:
         reader = csv.reader(f)
-        rows = list(reader)
+        rows = [tuple(row[:10]) for row in reader]
 
     # サマリー情報を抽出（重複排除前に実行）
     summaries = parse_summaries_from_csv(rows)
@@ -277,9 +294,6 @@ def main():
     # 月末日分離計算
     results = calculate_split_data(rows, summaries, detail_ranges)
 
-    # 弥生仕訳CSV生成
-    journal_rows = generate_journal_csv(results, department, subsidiary_suffix)
-
     # 出力ファイル名を決定
     if not output_file:
         basename = os.path.basename(input_file)
@@ -288,13 +302,17 @@ def main():
         output_dir = os.path.dirname(input_file)
         output_file = os.path.join(output_dir, f'仕訳_{yyyymm}.csv')
 
-    # CSV出力（弥生会計はShift-JIS/CP932が必須）
+    # 弥生仕訳CSV出力（弥生会計はShift-JIS/CP932が必須）
+    # 仕訳行はリストに溜めず、生成しながら書き込む
+    row_count = 0
     with open(output_file, 'w', encoding='cp932', newline='') as f:
         writer = csv.writer(f)
-        writer.writerows(journal_rows)
+        for journal_row in iter_journal_rows(results, department, subsidiary_suffix):
+            writer.writerow(journal_row)
+            row_count += 1
 
     print(f'Output: {output_file}')
-    print(f'Total rows: {len(journal_rows)}')
+    print(f'Total rows: {row_count}')
     print()
     print('=== 仕訳サマリー ===')
     for r in results:
@@ -43,6 +43,15 @@ def parse_date(date_str: str) -> datetime | None:
             except (ValueError, IndexError):
                 pass
 
+    # YYYY/MM/DD・YYYY-MM-DD・YYYY.MM.DD はstrptimeを使わず直接変換
+    if len(date_str) == 10 and date_str[4] in '/-.' and date_str[7] == date_str[4]:
+        year, month, day = date_str[:4], date_str[5:7], date_str[8:10]
+        if date_str.isascii() and year.isdigit() and month.isdigit() and day.isdigit():
+            try:
+                return datetime(int(year), int(month), int(day))
+            except ValueError:
+                pass
+
     # 標準形式を試行
     formats = [
         '%Y/%m/%d',
@@ -119,6 +128,26 @@ def validate_row(row: dict, prev_balance: int | None) -> tuple[bool, str, int |
     return True, '', balance
 
 
+def is_one_digit_change(original: int, fixed: int) -> bool:
+    """同じ桁数の2つの金額が1桁だけ異なるかを判定（文字列化せず整数演算で比較）"""
+    if original < 0 or fixed < 0:
+        return False
+
+    changes = 0
+    while True:
+        original, original_digit = divmod(original, 10)
+        fixed, fixed_digit = divmod(fixed, 10)
+        if original_digit != fixed_digit:
+            changes += 1
+            if changes > 1:
+                return False
+        if not original or not fixed:
+            break
+
+    # 両方の桁を使い切っていれば同じ桁数
+    return original == fixed and changes == 1
+
+
 def try_fix_amount(prev_balance: int, deposit: int, withdrawal: int, balance: int) -> tuple[int, int, str] | None:
     """
     1桁のOCR誤読を修正
@@ -135,25 +164,15 @@ def try_fix_amount(prev_balance: int, deposit: int, withdrawal: int, balance: in
     # 入金額の1桁修正を試行
     if withdrawal == 0:
         fixed_deposit = deposit + diff
-        if fixed_deposit >= 0:
-            # 1桁置換で済むかチェック
-            deposit_str = str(deposit)
-            fixed_str = str(fixed_deposit)
-            if len(deposit_str) == len(fixed_str):
-                changes = sum(1 for a, b in zip(deposit_str, fixed_str) if a != b)
-                if changes == 1:
-                    return fixed_deposit, withdrawal, f"入金額修正: {deposit} -> {fixed_deposit}"
+        # 1桁置換で済むかチェック
+        if is_one_digit_change(deposit, fixed_deposit):
+            return fixed_deposit, withdrawal, f"入金額修正: {deposit} -> {fixed_deposit}"
 
     # 出金額の1桁修正を試行
     if deposit == 0:
         fixed_withdrawal = withdrawal - diff
-        if fixed_withdrawal >= 0:
-            withdrawal_str = str(withdrawal)
-            fixed_str = str(fixed_withdrawal)
-            if len(withdrawal_str) == len(fixed_str):
-                changes = sum(1 for a, b in zip(withdrawal_str, fixed_str) if a != b)
-                if changes == 1:
-                    return deposit, fixed_withdrawal, f"出金額修正: {withdrawal} -> {fixed_withdrawal}"
+        if is_one_digit_change(withdrawal, fixed_withdrawal):
+            return deposit, fixed_withdrawal, f"出金額修正: {withdrawal} -> {fixed_withdrawal}"
 
     return None
 
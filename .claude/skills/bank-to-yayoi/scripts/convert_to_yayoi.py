@@ -4,8 +4,12 @@
 """
 
 import csv
+import functools
+import itertools
 import os
+import re
 import sys
+from collections.abc import Iterator
 from pathlib import Path
 
 
@@ -40,84 +44,114 @@ STORE_MAPPING = {
 }
 
 
-def get_store_sub_accounts(store: str) -> dict:
-    """店舗名から補助科目を取得"""
-    if store in STORE_MAPPING:
-        return STORE_MAPPING[store]
-    # マッピングがない場合は店舗名をそのまま使用
-    return {
-        "普通預金の補助科目": store,
-        "現金の補助科目": store,
-    }
+# 店舗名 → (普通預金の補助科目, 現金の補助科目)
+STORE_SUB_ACCOUNTS = {
+    store: (accounts["普通預金の補助科目"], accounts["現金の補助科目"])
+    for store, accounts in STORE_MAPPING.items()
+}
 
 
-def get_journal_entry(tekiyo: str, store: str, amount: int, is_deposit: bool) -> dict:
-    """摘要から仕訳を決定
+def get_store_sub_accounts(store: str) -> tuple:
+    """店舗名から補助科目を取得
+
+    Returns:
+        (普通預金の補助科目, 現金の補助科目)
+        マッピングがない場合は店舗名をそのまま使用
+    """
+    return STORE_SUB_ACCOUNTS.get(store, (store, store))
+
+
+# 摘要の分類コード
+ENTRY_TRANSFER = 0  # 資金移動（アオギリコーポレーション宛）
+ENTRY_CASH = 1      # ATM出金・カード（現金引出）
+ENTRY_FEE = 2       # 手数料
+ENTRY_OTHER = 3     # その他の出金
+ENTRY_DEPOSIT = 4   # 入金
+
+# 資金移動・手数料のキーワードを1回の走査で検出するパターン
+KEYWORD_PATTERN = re.compile("(?P<transfer>ｱｵｷﾞﾘｺｰﾎﾟﾚ|アオギリコーポレ)|(?P<fee>手数料)")
+CASH_TEKIYO = frozenset(("ATM出金", "カード", "CD"))
+
+
+def classify_tekiyo(tekiyo: str, is_deposit: bool) -> int:
+    """摘要と入出金区分から仕訳の分類コードを決定"""
+    if is_deposit:
+        return ENTRY_DEPOSIT
+
+    # 現金引出の摘要はキーワードを含まないため、完全一致を先に判定しても優先順位は変わらない
+    if tekiyo in CASH_TEKIYO:
+        return ENTRY_CASH
+
+    # 資金移動は手数料より優先（手数料を先に検出しても走査を続ける）
+    code = ENTRY_OTHER
+    for match in KEYWORD_PATTERN.finditer(tekiyo):
+        if match.lastgroup == "transfer":
+            return ENTRY_TRANSFER
+        code = ENTRY_FEE
+    return code
+
+
+@functools.lru_cache(maxsize=None)
+def get_journal_entries(deposit_sub: str, cash_sub: str) -> tuple:
+    """店舗の補助科目ごとの仕訳テンプレートを分類コード順に返す
+
+    各仕訳は (借方科目, 借方補助科目, 貸方科目, 貸方補助科目, 税区分) のタプル。
 
     基本ルール：
     - 入金（is_deposit=True）→ 普通預金が借方
     - 出金（is_deposit=False）→ 普通預金が貸方
     """
+    return (
+        # ENTRY_TRANSFER: 資金移動（アオギリコーポレーション宛）
+        ("普通預金", "資金移動", "普通預金", deposit_sub, "対象外"),
+        # ENTRY_CASH: ATM出金・カード（現金引出）
+        ("小口現金", cash_sub, "普通預金", deposit_sub, "対象外"),
+        # ENTRY_FEE: 手数料（カード手数料、振込手数料）
+        ("支払手数料", "", "普通預金", deposit_sub, "対象外"),
+        # ENTRY_OTHER: その他の出金（デフォルト: 小口現金への出金）
+        ("小口現金", cash_sub, "普通預金", deposit_sub, "対象外"),
+        # ENTRY_DEPOSIT: AD、ATM入金、現金などの入金
+        ("普通預金", deposit_sub, "現金", cash_sub, "対象外"),
+    )
+
+
+def get_journal_entry(tekiyo: str, deposit_sub: str, cash_sub: str, is_deposit: bool) -> tuple:
+    """摘要から仕訳を決定
+
+    Returns:
+        (debit_account, debit_sub, credit_account, credit_sub, tax)
+    """
+    return get_journal_entries(deposit_sub, cash_sub)[classify_tekiyo(tekiyo, is_deposit)]
+
+
+@functools.lru_cache(maxsize=8192)
+def get_row_template(tekiyo: str, deposit_sub: str, cash_sub: str, is_deposit: bool) -> tuple:
+    """取引日付・金額以外の固定部分を組み立てる（同じ摘要は繰り返し出現するためキャッシュ）
+
+    弥生会計形式の25項目:
+      A: 識別フラグ(2000)  B: 伝票No  C: 決算  D: 取引日付
+      E: 借方勘定科目  F: 借方補助科目  G: 借方部門  H: 借方税区分  I: 借方金額  J: 借方税金額
+      K: 貸方勘定科目  L: 貸方補助科目  M: 貸方部門  N: 貸方税区分  O: 貸方金額  P: 貸方税金額
+      Q: 摘要  R: 備考  S: 伝票番号自動設定  T: 伝票種別(0)  U: 税計算区分  V: 税額計算対象
+      W: 請求書区分  X: 仕入税額控除  Y: 定型(0)
+
+    Returns:
+        (E〜H列, J〜N列, P〜Y列+改行) の各区切り済みShift-JISバイト列
+    """
+    debit_account, debit_sub, credit_account, credit_sub, tax = get_journal_entry(
+        tekiyo, deposit_sub, cash_sub, is_deposit
+    )
+    return (
+        f",{debit_account},{debit_sub},,{tax},".encode("cp932"),
+        f",,{credit_account},{credit_sub},,{tax},".encode("cp932"),
+        f",,{tekiyo},,,0,,,,,0\r\n".encode("cp932"),
+    )
+
 
-    # 店舗の補助科目を取得
-    sub_accounts = get_store_sub_accounts(store)
-    deposit_sub = sub_accounts["普通預金の補助科目"]
-    cash_sub = sub_accounts["現金の補助科目"]
-
-    # === 出金パターン（普通預金が貸方） ===
-    if not is_deposit:
-        # 資金移動（アオギリコーポレーション宛）
-        if "ｱｵｷﾞﾘｺｰﾎﾟﾚ" in tekiyo or "アオギリコーポレ" in tekiyo:
-            return {
-                "debit_account": "普通預金",
-                "debit_sub": "資金移動",
-                "credit_account": "普通預金",
-                "credit_sub": deposit_sub,
-                "tax": "対象外",
-            }
-
-        # ATM出金・カード（現金引出）
-        if tekiyo in ("ATM出金", "カード", "CD"):
-            return {
-                "debit_account": "小口現金",
-                "debit_sub": cash_sub,
-                "credit_account": "普通預金",
-                "credit_sub": deposit_sub,
-                "tax": "対象外",
-            }
-
-        # 手数料（カード手数料、振込手数料）
-        if "手数料" in tekiyo:
-            return {
-                "debit_account": "支払手数料",
-                "debit_sub": "",
-                "credit_account": "普通預金",
-                "credit_sub": deposit_sub,
-                "tax": "対象外",
-            }
-
-        # その他の出金（デフォルト: 小口現金への出金）
-        return {
-            "debit_account": "小口現金",
-            "debit_sub": cash_sub,
-            "credit_account": "普通預金",
-            "credit_sub": deposit_sub,
-            "tax": "対象外",
-        }
-
-    # === 入金パターン（普通預金が借方） ===
-    # AD、ATM入金、現金などの入金
-    return {
-        "debit_account": "普通預金",
-        "debit_sub": deposit_sub,
-        "credit_account": "現金",
-        "credit_sub": cash_sub,
-        "tax": "対象外",
-    }
-
-
-def convert_row_to_yayoi(date: str, tekiyo: str, withdrawal: int, deposit: int, store: str) -> str:
-    """1行を弥生会計形式に変換"""
+def convert_row_to_yayoi(
+    date: str, tekiyo: str, withdrawal: int, deposit: int, deposit_sub: str, cash_sub: str
+) -> bytes:
+    """1行を弥生会計形式（Shift-JIS・CRLF）に変換"""
 
     # 金額を決定
     if deposit > 0:
@@ -127,66 +161,57 @@ def convert_row_to_yayoi(date: str, tekiyo: str, withdrawal: int, deposit: int,
         amount = withdrawal
         is_deposit = False
 
-    # 仕訳を取得
-    entry = get_journal_entry(tekiyo, store, amount, is_deposit)
-
-    # 弥生会計形式の25項目を構築
-    columns = [
-        "2000",                      # A: 識別フラグ
-        "",                          # B: 伝票No
-        "",                          # C: 決算
-        date,                        # D: 取引日付
-        entry["debit_account"],      # E: 借方勘定科目
-        entry["debit_sub"],          # F: 借方補助科目
-        "",                          # G: 借方部門
-        entry["tax"],                # H: 借方税区分
-        str(amount),                 # I: 借方金額
-        "",                          # J: 借方税金額
-        entry["credit_account"],     # K: 貸方勘定科目
-        entry["credit_sub"],         # L: 貸方補助科目
-        "",                          # M: 貸方部門
-        entry["tax"],                # N: 貸方税区分
-        str(amount),                 # O: 貸方金額
-        "",                          # P: 貸方税金額
-        tekiyo,                      # Q: 摘要
-        "",                          # R: 備考
-        "",                          # S: 伝票番号自動設定
-        "0",                         # T: 伝票種別
-        "",                          # U: 税計算区分
-        "",                          # V: 税額計算対象
-        "",                          # W: 請求書区分
-        "",                          # X: 仕入税額控除
-        "0",                         # Y: 定型
-    ]
-
-    return ",".join(columns)
-
-
-def convert_file_to_lines(input_path: Path) -> list:
-    """CSVファイルを変換して行リストを返す"""
+    # エンコード済みの固定部分に取引日付と金額を埋め込む
+    debit_part, credit_part, tail = get_row_template(tekiyo, deposit_sub, cash_sub, is_deposit)
+    return b"2000,,,%b%b%d%b%d%b" % (date.encode("cp932"), debit_part, amount, credit_part, amount, tail)
+
+
+def convert_file_to_lines(input_path: Path) -> Iterator[bytes]:
+    """CSVファイルを変換し、Shift-JIS・CRLFの出力行を1行ずつ返す"""
 
     store = extract_store_name(input_path.name)
     print(f"Processing: {input_path.name} (store: {store})")
 
-    output_lines = []
+    # 店舗はファイル内で共通なので、補助科目は行ループの前に1回だけ求める
+    deposit_sub, cash_sub = get_store_sub_accounts(store)
+
+    row_count = 0
 
     with open(input_path, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+
+        # 列位置はヘッダーから1回だけ求め、各行は位置で参照する
+        header = next(reader, [])
+        if not header:
+            # 空ファイルは0行として扱う
+            print("  -> 0 rows")
+            return
+        date_idx = header.index("日付")
+        tekiyo_idx = header.index("摘要")
+        withdrawal_idx = header.index("出金額")
+        deposit_idx = header.index("入金額")
+        width = len(header)
+
         for row in reader:
-            date = row["日付"]
-            tekiyo = row["摘要"]
-            withdrawal = int(row["出金額"]) if row["出金額"] else 0
-            deposit = int(row["入金額"]) if row["入金額"] else 0
+            # 空行はスキップ、列不足の行は空欄で補う
+            if not row:
+                continue
+            if len(row) < width:
+                row += [""] * (width - len(row))
+
+            date = row[date_idx]
+            tekiyo = row[tekiyo_idx]
+            withdrawal = int(row[withdrawal_idx]) if row[withdrawal_idx] else 0
+            deposit = int(row[deposit_idx]) if row[deposit_idx] else 0
 
             # 入出金が0の行はスキップ
             if withdrawal == 0 and deposit == 0:
                 continue
 
-            yayoi_line = convert_row_to_yayoi(date, tekiyo, withdrawal, deposit, store)
-            output_lines.append(yayoi_line)
+            row_count += 1
+            yield convert_row_to_yayoi(date, tekiyo, withdrawal, deposit, deposit_sub, cash_sub)
 
-    print(f"  -> {len(output_lines)} rows")
-    return output_lines
+    print(f"  -> {row_count} rows")
 
 
 def main():
@@ -210,18 +235,29 @@ def main():
         print(f"Error: No CSV files found in {input_folder}")
         sys.exit(1)
 
-    # 全ファイルを1つに統合
-    all_lines = []
-    for csv_file in sorted(csv_files):
-        all_lines.extend(convert_file_to_lines(csv_file))
-
-    # Shift-JIS, CRLF で1ファイルに出力
-    with open(output_file, "w", encoding="cp932", newline="") as f:
-        f.write("\r\n".join(all_lines))
-        f.write("\r\n")
+    # 全ファイルを1つに統合し、Shift-JIS, CRLF で変換しながら順次書き込む
+    # 途中でエラーになった場合に不完全なファイルを残さないよう、一時ファイルに書いてから置き換える
+    temp_file = output_file.with_name(output_file.name + ".tmp")
+    total_rows = 0
+
+    def count_lines(lines):
+        """書き込む行を数えながらそのまま返す"""
+        nonlocal total_rows
+        for line in lines:
+            total_rows += 1
+            yield line
+
+    try:
+        lines = itertools.chain.from_iterable(map(convert_file_to_lines, sorted(csv_files)))
+        with open(temp_file, "wb", buffering=1 << 20) as f:
+            f.writelines(count_lines(lines))
+        os.replace(temp_file, output_file)
+    finally:
+        if temp_file.exists():
+            temp_file.unlink()
 
     print(f"\nOutput: {output_file}")
-    print(f"Completed: {len(csv_files)} files -> {len(all_lines)} total rows")
+    print(f"Completed: {len(csv_files)} files -> {total_rows} total rows")
 
 
 if __name__ == "__main__":
@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 """
-safe_read_pdf.py - 大容量PDF自動分割読み込みスクリプト
+safe_read_pdf.py - 大容量PDF安全読み込みスクリプト
 
 Claude CodeのAPI制限（約5-10MB）を回避するため、
-大きなPDFを自動的に分割してテキストを抽出する。
+PDFをファイルのまま渡さず、テキストを抽出してJSONで返す。
 スキャンPDFの場合は画像に変換してClaude Codeで読み込めるようにする。
 
 使用方法:
@@ -17,12 +17,14 @@ Claude CodeのAPI制限（約5-10MB）を回避するため、
     JSON形式で結果を出力
 """
 
+import io
 import os
+import ctypes
+import functools
 import sys
 import json
-import tempfile
-import shutil
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 # サイズ閾値（MB）
@@ -30,6 +32,14 @@ DEFAULT_THRESHOLD_MB = 3.0
 TARGET_CHUNK_SIZE_MB = 2.0
 MAX_PAGES_PER_CHUNK = 5
 TARGET_IMAGE_SIZE_MB = 2.0  # 画像1枚あたりの目標サイズ
+MAX_IMAGE_WORKERS = 8       # 画像変換の最大並列プロセス数
+MIN_JPEG_QUALITY = 30         # 品質調整の下限（これでも目標を超える場合は縮小する）
+BILINEAR_MIN_REDUCTION = 0.7   # 縮小率がこれより大きい（軽い縮小）ならBILINEARで十分
+RENDER_SCALE = 2.0             # 初期解像度（72 * 2 = 144 DPI）
+MIN_RENDER_SCALE = 0.8         # 縮小を引き継ぐ場合の下限（文字の判読性を保つため）
+
+# コンテンツストリーム中の文字描画オペレータ（Tj, TJ, ', "）
+TEXT_SHOW_OPERATORS = (b"Tj", b"TJ", b"'", b'"')
 
 
 def get_file_size_mb(file_path: str) -> float:
@@ -37,12 +47,40 @@ def get_file_size_mb(file_path: str) -> float:
     return os.path.getsize(file_path) / (1024 * 1024)
 
 
-def analyze_pdf(pdf_path: str) -> dict:
-    """PDFを分析して情報を返す"""
+def may_contain_text(page) -> bool:
+    """ページに文字描画がありうるかをコンテンツストリームから判定
+
+    文字描画オペレータが1つもなければテキスト抽出しても空なので、
+    抽出処理を省略できる。Form XObject（中に文字を含みうる）がある場合や
+    判定できない場合はTrueを返す。
+    """
+    try:
+        resources = page.get("/Resources")
+        if resources is None:
+            return True  # 親から継承したリソースまでは見ない
+        xobjects = resources.get_object().get("/XObject")
+        if xobjects is not None:
+            for xobject in xobjects.get_object().values():
+                if xobject.get_object().get("/Subtype") != "/Image":
+                    return True
+
+        content = page.get_contents()
+        data = content.get_data() if content is not None else b""
+        return any(op in data for op in TEXT_SHOW_OPERATORS)
+    except Exception:
+        return True
+
+
+def open_and_analyze_pdf(pdf_path: str) -> tuple:
+    """PDFを開いて分析し、(情報, PdfReader) を返す
+
+    呼び出し側でテキスト抽出にもreaderを使い回せるよう、開いたreaderも返す。
+    エラー時のreaderはNone。
+    """
     try:
         from pypdf import PdfReader
     except ImportError:
-        return {"error": "pypdf がインストールされていません。pip install pypdf を実行してください。"}
+        return {"error": "pypdf がインストールされていません。pip install pypdf を実行してください。"}, None
 
     file_size_mb = get_file_size_mb(pdf_path)
 
@@ -50,11 +88,14 @@ def analyze_pdf(pdf_path: str) -> dict:
         reader = PdfReader(pdf_path)
         page_count = len(reader.pages)
     except Exception as e:
-        return {"error": f"PDF読み込みエラー: {str(e)}"}
+        return {"error": f"PDF読み込みエラー: {str(e)}"}, None
 
     # スキャンPDFか判定（最初の3ページでテキスト抽出を試みる）
+    # 文字描画のないページ（画像のみのスキャン等）は抽出を省略する
     sample_text = ""
     for i, page in enumerate(reader.pages[:3]):
+        if not may_contain_text(page):
+            continue
         try:
             sample_text += page.extract_text() or ""
         except:
@@ -69,7 +110,12 @@ def analyze_pdf(pdf_path: str) -> dict:
         "page_count": page_count,
         "avg_page_size_mb": round(avg_page_size_mb, 3),
         "is_scanned": is_scanned
-    }
+    }, reader
+
+
+def analyze_pdf(pdf_path: str) -> dict:
+    """PDFを分析して情報を返す"""
+    return open_and_analyze_pdf(pdf_path)[0]
 
 
 def calculate_pages_per_chunk(file_size_mb: float, page_count: int) -> int:
@@ -85,42 +131,13 @@ def calculate_pages_per_chunk(file_size_mb: float, page_count: int) -> int:
     return min(pages_per_chunk, MAX_PAGES_PER_CHUNK)
 
 
-def split_pdf(pdf_path: str, output_dir: str, pages_per_chunk: int) -> list:
-    """PDFをチャンクに分割"""
-    from pypdf import PdfReader, PdfWriter
-
-    reader = PdfReader(pdf_path)
-    total_pages = len(reader.pages)
-    chunks = []
-    chunk_num = 1
-
-    for start_page in range(0, total_pages, pages_per_chunk):
-        end_page = min(start_page + pages_per_chunk, total_pages)
-
-        writer = PdfWriter()
-        for page_idx in range(start_page, end_page):
-            writer.add_page(reader.pages[page_idx])
+def extract_text_from_pdf(pdf_path: str, reader=None) -> list:
+    """PDFからテキストを抽出（ページごと）
 
-        chunk_filename = f"chunk_{chunk_num:03d}.pdf"
-        chunk_path = os.path.join(output_dir, chunk_filename)
-
-        with open(chunk_path, "wb") as f:
-            writer.write(f)
-
-        chunks.append({
-            "chunk_num": chunk_num,
-            "file_path": chunk_path,
-            "start_page": start_page + 1,
-            "end_page": end_page
-        })
-
-        chunk_num += 1
-
-    return chunks
-
-
-def extract_text_from_pdf(pdf_path: str) -> list:
-    """PDFからテキストを抽出（ページごと）"""
+    処理済みページのキャッシュは都度解放するため、大きなPDFでも1回開くだけでよい。
+    readerが渡されていれば、pypdfへのフォールバックと、文字描画のないページ
+    （スキャン画像のみのページ等）でのテキスト抽出の省略に使う。
+    """
     try:
         import pdfplumber
         use_pdfplumber = True
@@ -133,8 +150,18 @@ def extract_text_from_pdf(pdf_path: str) -> list:
         try:
             with pdfplumber.open(pdf_path) as pdf:
                 for i, page in enumerate(pdf.pages):
-                    text = page.extract_text() or ""
-                    tables = page.extract_tables()
+                    # 文字描画オペレータのないページは抽出しても空なので省略する
+                    # （罫線はあり得るため、テーブル検出は通常どおり行う）
+                    if reader is not None and not may_contain_text(reader.pages[i]):
+                        text = ""
+                    else:
+                        text = page.extract_text() or ""
+                    # 罫線で囲まれたセルには縦横それぞれ2本以上の罫線が必要なので、
+                    # 満たさないページ（文章のみ等）では重いテーブル検出を省略する
+                    if len(page.horizontal_edges) < 2 or len(page.vertical_edges) < 2:
+                        tables = []
+                    else:
+                        tables = page.extract_tables()
 
                     # テーブルがあれば整形して追加
                     table_text = ""
@@ -149,13 +176,17 @@ def extract_text_from_pdf(pdf_path: str) -> list:
                         "text": text,
                         "tables": table_text if table_text else None
                     })
+
+                    # 解析済みページのキャッシュを解放
+                    page.close()
         except Exception as e:
             # pdfplumberで失敗した場合はpypdfにフォールバック
             use_pdfplumber = False
 
     if not use_pdfplumber:
-        from pypdf import PdfReader
-        reader = PdfReader(pdf_path)
+        if reader is None:
+            from pypdf import PdfReader
+            reader = PdfReader(pdf_path)
         for i, page in enumerate(reader.pages):
             text = page.extract_text() or ""
             pages.append({
@@ -167,12 +198,162 @@ def extract_text_from_pdf(pdf_path: str) -> list:
     return pages
 
 
+def encode_jpeg(img, quality: int) -> bytes:
+    """画像をメモリ上でJPEGにエンコード"""
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality, optimize=True, subsampling=2)  # 4:2:0
+    return buf.getvalue()
+
+
+def encode_jpeg_within(img, target_size_mb: float, probe_data: bytes, probe_quality: int = 85) -> bytes:
+    """目標サイズに収まるできるだけ高い品質でJPEGにエンコード
+
+    probe_dataは品質probe_qualityでのエンコード結果。まずサイズ比から必要な品質を見積もって
+    エンコードし、外れた場合はその品質から下限までを二分探索する。
+    下限の品質でも収まらない場合は、下限品質での結果を返す。
+    """
+    target_bytes = target_size_mb * 1024 * 1024
+
+    # JPEGのサイズは品質に対しておおむね単調に変化するため、サイズ比から品質を見積もる
+    quality = max(MIN_JPEG_QUALITY, int(probe_quality * (target_bytes / len(probe_data)) ** 0.7))
+    data = encode_jpeg(img, quality=quality)
+    if len(data) <= target_bytes or quality == MIN_JPEG_QUALITY:
+        return data
+
+    # 見積もりが外れた場合は、収まる最も高い品質を二分探索
+    best = None
+    low, high = MIN_JPEG_QUALITY, quality - 1
+    while low <= high:
+        mid = (low + high) // 2
+        data = encode_jpeg(img, quality=mid)
+        if len(data) <= target_bytes:
+            best = data
+            low = mid + 1
+        else:
+            high = mid - 1
+
+    # どの品質でも収まらない場合、最後に試した品質は下限になっている
+    return best if best is not None else data
+
+
+def render_page_image(page, scale: float, bitmap_maker):
+    """ページを描画し、pdfiumのバッファをそのままPIL画像として扱う
+
+    rev_byteorderでRGB順に出力させ、BGR→RGBの並べ替えを省く。
+    """
+    from PIL import Image
+
+    bitmap = page.render(scale=scale, rev_byteorder=True, bitmap_maker=bitmap_maker)
+    return Image.frombuffer("RGB", (bitmap.width, bitmap.height), bitmap.buffer,
+                            "raw", "RGB", bitmap.stride, 1)
+
+
+def make_pooled_bitmap(pool: dict, width: int, height: int, format: int, rev_byteorder: bool = False):
+    """poolのバッファを使い回してpdfiumのビットマップを作成（page.renderのbitmap_maker用）
+
+    バッファが足りない場合だけ確保し直すため、同じサイズのページが続けば
+    ページごとの大きなメモリ確保が発生しない。
+    """
+    import pypdfium2 as pdfium
+
+    size = width * 4 * height  # 1画素あたり最大4バイト（BGRA/BGRx）
+    if len(pool.get("buffer", ())) < size:
+        pool["buffer"] = (ctypes.c_ubyte * size)()
+    return pdfium.PdfBitmap.new_native(width, height, format, rev_byteorder, buffer=pool["buffer"])
+
+
+def render_pages_to_images(pdf_path: str, page_indices: list, output_dir: str, target_size_mb: float,
+                           hint_scale: float = None) -> tuple:
+    """
+    指定ページをJPEG画像に変換（ワーカープロセスで実行）
+
+    pdfiumの状態はプロセスごとに持つため、呼び出しごとにPDFを開き直す。
+
+    hint_scaleは縮小が必要だったページから求めた描画解像度の目安。各ページはまずこの解像度で
+    描画し、品質85でも目標サイズを超える（縮小元のページと同様に重い）場合だけそのまま使う。
+    目標サイズに収まるページは初期解像度で描画し直し、通常どおり品質・サイズを調整する。
+
+    Returns:
+        (画像情報のリスト, hint_scale未指定時に縮小が必要なページがあればそこから求めた目安)
+    """
+    import pypdfium2 as pdfium
+    from PIL import Image
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    image_files = []
+    new_hint_scale = None
+    target_bytes = target_size_mb * 1024 * 1024
+
+    # レンダリング先のバッファはページ間で使い回す
+    bitmap_maker = functools.partial(make_pooled_bitmap, {})
+
+    try:
+        for i in page_indices:
+            page = pdf[i]
+
+            # 目安の解像度で描画し、品質85でメモリ上にエンコードしてサイズを計測
+            page_scale = RENDER_SCALE
+            if hint_scale is not None:
+                img = render_page_image(page, hint_scale, bitmap_maker)
+                data = encode_jpeg(img, quality=85)
+                if len(data) > target_bytes:
+                    page_scale = hint_scale
+
+            # 初期解像度で描画（目安の解像度を使わない場合）
+            if page_scale == RENDER_SCALE:
+                img = render_page_image(page, page_scale, bitmap_maker)
+                data = encode_jpeg(img, quality=85)
+
+            # JPEG形式で保存（品質を調整してサイズを制御）
+            page_filename = f"page_{i+1:03d}.jpg"
+            page_path = os.path.join(output_dir, page_filename)
+
+            probe_size_mb = file_size_mb = len(data) / (1024 * 1024)
+
+            # 目標サイズを超える場合は、まず品質を下げて収める
+            if file_size_mb > target_size_mb:
+                data = encode_jpeg_within(img, target_size_mb, data)
+                file_size_mb = len(data) / (1024 * 1024)
+
+            # 品質を下限まで下げても大きい場合は画像サイズを縮小
+            if file_size_mb > target_size_mb:
+                # 縮小率を計算（品質70で再エンコードするため、品質85時のサイズを基準にする）
+                reduction = (target_size_mb / probe_size_mb) ** 0.5
+
+                # 初期解像度で縮小が必要になった最初のページから、他のページ用の目安を求める
+                if new_hint_scale is None and page_scale == RENDER_SCALE:
+                    new_hint_scale = max(MIN_RENDER_SCALE, page_scale * reduction)
+
+                new_width = int(img.width * reduction)
+                new_height = int(img.height * reduction)
+                resample = Image.BILINEAR if reduction > BILINEAR_MIN_REDUCTION else Image.LANCZOS
+                img_resized = img.resize((new_width, new_height), resample)
+                data = encode_jpeg(img_resized, quality=70)
+                if len(data) > target_bytes:
+                    data = encode_jpeg_within(img_resized, target_size_mb, data, probe_quality=70)
+                file_size_mb = len(data) / (1024 * 1024)
+
+            with open(page_path, "wb") as f:
+                f.write(data)
+
+            image_files.append({
+                "page": i + 1,
+                "file_path": os.path.abspath(page_path),
+                "size_mb": round(file_size_mb, 2)
+            })
+    finally:
+        pdf.close()
+
+    return image_files, new_hint_scale
+
+
 def convert_pdf_to_images(pdf_path: str, output_dir: str, target_size_mb: float = TARGET_IMAGE_SIZE_MB) -> dict:
     """
     PDFを画像に変換（スキャンPDF用）
 
     各ページをJPEG画像に変換し、目標サイズ以下に圧縮する。
     Claude CodeのReadツールで読み込める形式で出力。
+    ページは連続した範囲ごとに複数プロセスで並列に変換する。
     """
     try:
         import pypdfium2 as pdfium
@@ -196,50 +377,38 @@ def convert_pdf_to_images(pdf_path: str, output_dir: str, target_size_mb: float
     try:
         pdf = pdfium.PdfDocument(pdf_path)
         page_count = len(pdf)
-        image_files = []
-
-        for i in range(page_count):
-            page = pdf[i]
-
-            # 初期解像度（150 DPI相当）
-            scale = 2.0  # 72 * 2 = 144 DPI
-
-            # 画像をレンダリング
-            bitmap = page.render(scale=scale)
-            img = bitmap.to_pil()
-
-            # JPEG形式で保存（品質を調整してサイズを制御）
-            page_filename = f"page_{i+1:03d}.jpg"
-            page_path = os.path.join(output_dir, page_filename)
-
-            # 品質を調整して目標サイズ以下にする
-            quality = 85
-            while quality >= 30:
-                img.save(page_path, "JPEG", quality=quality, optimize=True)
-                file_size_mb = os.path.getsize(page_path) / (1024 * 1024)
-
-                if file_size_mb <= target_size_mb:
-                    break
-                quality -= 10
-
-            # それでも大きい場合は画像サイズを縮小
-            if file_size_mb > target_size_mb:
-                # 縮小率を計算
-                reduction = (target_size_mb / file_size_mb) ** 0.5
-                new_width = int(img.width * reduction)
-                new_height = int(img.height * reduction)
-                img_resized = img.resize((new_width, new_height), Image.LANCZOS)
-                img_resized.save(page_path, "JPEG", quality=70, optimize=True)
-                file_size_mb = os.path.getsize(page_path) / (1024 * 1024)
-
-            image_files.append({
-                "page": i + 1,
-                "file_path": os.path.abspath(page_path),
-                "size_mb": round(file_size_mb, 2)
-            })
-
         pdf.close()
 
+        # 1ページ目を先に変換し、縮小が必要だった場合はその縮小率を反映した解像度を
+        # 残りのページの描画解像度の目安にする（同じPDFのページはサイズ・画質がそろっていることが多く、
+        # 最初から小さく描画すればレンダリング・エンコード・縮小の処理量がまとめて減る。
+        # ワーカー数によらず同じ結果になるよう、目安を求めるのはこの1回だけとする）
+        image_files = []
+        hint_scale = None
+        if page_count:
+            image_files, hint_scale = render_pages_to_images(pdf_path, [0], output_dir, target_size_mb)
+
+        # 残りのページを連続した範囲に分けてワーカーに割り当てる
+        rest_count = page_count - 1
+        workers = max(1, min(MAX_IMAGE_WORKERS, os.cpu_count() or 1, rest_count))
+        batch_size = -(-rest_count // workers) if rest_count > 0 else 1
+        batches = [
+            list(range(start, min(start + batch_size, page_count)))
+            for start in range(1, page_count, batch_size)
+        ]
+
+        if workers == 1:
+            for batch in batches:
+                image_files.extend(render_pages_to_images(pdf_path, batch, output_dir, target_size_mb, hint_scale)[0])
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(render_pages_to_images, pdf_path, batch, output_dir, target_size_mb, hint_scale)
+                    for batch in batches
+                ]
+                for future in futures:
+                    image_files.extend(future.result()[0])
+
         return {
             "success": True,
             "mode": "images",
@@ -260,7 +429,8 @@ def safe_read_pdf(pdf_path: str, threshold_mb: float = DEFAULT_THRESHOLD_MB) ->
     """
     メイン関数: PDFを安全に読み込む
 
-    大きなPDFは自動的に分割して処理し、結果を統合して返す。
+    サイズに関わらず全ページのテキストを1回で抽出して返す。
+    閾値を超えるかどうかは exceeds_threshold として記録するのみ。
     """
     # ファイル存在チェック
     if not os.path.exists(pdf_path):
@@ -269,8 +439,8 @@ def safe_read_pdf(pdf_path: str, threshold_mb: float = DEFAULT_THRESHOLD_MB) ->
             "error": f"ファイルが見つかりません: {pdf_path}"
         }
 
-    # PDF分析
-    analysis = analyze_pdf(pdf_path)
+    # PDF分析（開いたreaderはテキスト抽出でも使い回す）
+    analysis, reader = open_and_analyze_pdf(pdf_path)
     if "error" in analysis:
         return {
             "success": False,
@@ -287,7 +457,7 @@ def safe_read_pdf(pdf_path: str, threshold_mb: float = DEFAULT_THRESHOLD_MB) ->
         "file_size_mb": file_size_mb,
         "total_pages": page_count,
         "is_scanned": is_scanned,
-        "was_split": False,
+        "exceeds_threshold": file_size_mb > threshold_mb,
         "pages": [],
         "content": ""
     }
@@ -296,70 +466,25 @@ def safe_read_pdf(pdf_path: str, threshold_mb: float = DEFAULT_THRESHOLD_MB) ->
     if is_scanned:
         result["warning"] = "スキャンPDFの可能性があります。テキスト抽出結果が不完全な場合があります。"
 
-    # 分割が必要かどうか判定
-    needs_split = file_size_mb > threshold_mb
-
-    if not needs_split:
-        # 分割不要: 直接テキスト抽出
-        try:
-            pages = extract_text_from_pdf(pdf_path)
-            result["pages"] = pages
-            result["content"] = "\n\n".join(
-                f"--- Page {p['page']} ---\n{p['text']}"
-                for p in pages
-            )
-        except Exception as e:
-            return {
-                "success": False,
-                "error": f"テキスト抽出エラー: {str(e)}"
-            }
-    else:
-        # 分割が必要
-        result["was_split"] = True
-        pages_per_chunk = calculate_pages_per_chunk(file_size_mb, page_count)
-        result["pages_per_chunk"] = pages_per_chunk
-
-        # 一時ディレクトリを作成
-        temp_dir = tempfile.mkdtemp(prefix="pdf_chunks_")
-
-        try:
-            # PDFを分割
-            chunks = split_pdf(pdf_path, temp_dir, pages_per_chunk)
-            result["chunk_count"] = len(chunks)
-
-            # 各チャンクからテキスト抽出
-            all_pages = []
-            for chunk in chunks:
-                chunk_pages = extract_text_from_pdf(chunk["file_path"])
-                # ページ番号を調整
-                for i, page in enumerate(chunk_pages):
-                    page["page"] = chunk["start_page"] + i
-                all_pages.extend(chunk_pages)
-
-            result["pages"] = all_pages
-            result["content"] = "\n\n".join(
-                f"--- Page {p['page']} ---\n{p['text']}"
-                for p in all_pages
-            )
-
-        except Exception as e:
-            return {
-                "success": False,
-                "error": f"分割処理エラー: {str(e)}"
-            }
-        finally:
-            # 一時ファイルをクリーンアップ
-            try:
-                shutil.rmtree(temp_dir)
-            except:
-                pass
+    try:
+        pages = extract_text_from_pdf(pdf_path, reader)
+        result["pages"] = pages
+        result["content"] = "\n\n".join(
+            f"--- Page {p['page']} ---\n{p['text']}"
+            for p in pages
+        )
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"テキスト抽出エラー: {str(e)}"
+        }
 
     return result
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description="大容量PDFを自動分割して安全に読み込む"
+        description="大容量PDFを安全に読み込む（テキスト抽出・画像変換）"
     )
     parser.add_argument(
         "pdf_path",
@@ -369,7 +494,7 @@ def main():
         "--threshold",
         type=float,
         default=DEFAULT_THRESHOLD_MB,
-        help=f"分割閾値（MB単位、デフォルト: {DEFAULT_THRESHOLD_MB}）"
+        help=f"大容量とみなすサイズ閾値（MB単位、デフォルト: {DEFAULT_THRESHOLD_MB}）。結果のメタデータにのみ使用"
     )
     parser.add_argument(
         "--analyze-only",